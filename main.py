@@ -1,12 +1,28 @@
 import argparse
-import configparser
-import json
+import itertools
 import os
 import re
 import sys
+import threading
+import time
 from dataclasses import dataclass
-from typing import Optional, Callable, Iterable, Tuple
-from urllib import request, error
+from typing import TYPE_CHECKING, Any, BinaryIO, Optional, Callable, Iterable, Iterator, Mapping, TextIO, Tuple
+
+# Сетевые модули (http.client, ssl, urllib.parse, concurrent.futures), hashlib, tempfile и парсер JSON
+# нужны только в режиме 'real' и импортируются в функциях, которые их используют:
+# запуск с тестовым репозиторием не тратит на них время
+if TYPE_CHECKING:
+    import http.client
+    import ssl
+
+# Имя пакета в начале строки requires_dist; ";" маркера окружения в имя не входит
+REQ_NAME_RE = re.compile(r"\s*([A-Za-z0-9_.\-]+)")
+# Маркер, состоящий только из условия на extra: без packaging распознаётся лишь такой случай
+EXTRA_MARKER_RE = re.compile(r"""\s*extra\s*==\s*(['"])[^'"]*\1\s*""")
+VERSION_RE = re.compile(r"\d+\.\d+(?:\.\d+)?")
+
+BOOL_VALUES = {"1": True, "true": True, "yes": True, "on": True,
+               "0": False, "false": False, "no": False, "off": False}
 
 
 class ConfigError(Exception):
@@ -17,7 +33,8 @@ class DependencyFetchError(Exception):
     """Ошибка при получении/построении зависимостей пакета."""
 
 
-@dataclass
+# Конфигурация неизменяема: один и тот же объект отдаётся из CONFIG_CACHE при каждом load_config
+@dataclass(slots=True, frozen=True)
 class AppConfig:
     package_name: str
     version: str
@@ -25,50 +42,104 @@ class AppConfig:
     repo_url: Optional[str]
     test_repo_path: Optional[str]
     ascii_tree: bool
+    repo_base: str = ""  # repo_url без завершающего "/", вычисляется один раз в load_config
 
 
 def parse_bool(value: str) -> bool:
-    true_values = {"1", "true", "yes", "on"}
-    false_values = {"0", "false", "no", "off"}
-
-    v = value.strip().lower()
-    if v in true_values:
-        return True
-    if v in false_values:
-        return False
-    raise ConfigError(f"Некорректное булево значение: {value!r}. "
-                      f"Ожидалось одно из: {', '.join(sorted(true_values | false_values))}")
+    result = BOOL_VALUES.get(value)
+    if result is not None:
+        return result
+    result = BOOL_VALUES.get(value.strip().lower())
+    if result is None:
+        raise ConfigError(f"Некорректное булево значение: {value!r}. "
+                          f"Ожидалось одно из: {', '.join(sorted(BOOL_VALUES))}")
+    return result
 
 
 def validate_version(version: str) -> None:
-    parts = version.split(".")
-    if not 2 <= len(parts) <= 3:
+    if VERSION_RE.fullmatch(version):
+        return
+    # Количество частей нужно только для выбора текста ошибки
+    if not 2 <= version.count(".") + 1 <= 3:
         raise ConfigError(f"Некорректная версия пакета: {version!r}. "
                           "Ожидался формат X.Y или X.Y.Z")
-    for p in parts:
-        if not p.isdigit():
-            raise ConfigError(f"Некорректная версия пакета: {version!r}. "
-                              "Части версии должны быть числами.")
+    raise ConfigError(f"Некорректная версия пакета: {version!r}. "
+                      "Части версии должны быть числами.")
+
+
+# Ключ — (абсолютный путь, mtime_ns, размер): изменение файла делает старую запись недостижимой
+CONFIG_CACHE: dict[Tuple[str, int, int], AppConfig] = {}
 
 
 def load_config(path: str) -> AppConfig:
-    if not os.path.exists(path):
-        raise ConfigError(f"Файл конфигурации не найден: {path}")
+    # Формат определяется по расширению: *.toml разбирает tomllib, остальное — configparser (INI)
+    try:
+        if path.endswith(".toml"):
+            with open(path, "rb") as toml_file:
+                config = cached_config(path, toml_file.fileno(), lambda: parse_toml_config(toml_file))
+        else:
+            with open(path, encoding="utf-8") as ini_file:
+                config = cached_config(path, ini_file.fileno(), lambda: parse_config(ini_file))
+    except FileNotFoundError:
+        raise ConfigError(f"Файл конфигурации не найден: {path}") from None
+    except OSError as e:
+        raise ConfigError(f"Не удалось прочитать файл конфигурации: {path}") from e
+    return config
+
+
+def cached_config(path: str, fd: int, parse: Callable[[], AppConfig]) -> AppConfig:
+    # Файл открывается один раз: fstat даёт ключ кэша, а при промахе тот же дескриптор читает парсер
+    st = os.fstat(fd)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    config = CONFIG_CACHE.get(key)
+    if config is None:
+        config = CONFIG_CACHE[key] = parse()
+    return config
+
+
+def parse_config(f: TextIO) -> AppConfig:
+    # configparser нужен только при промахе кэша конфигурации, поэтому импортируется здесь
+    import configparser
 
     parser = configparser.ConfigParser()
     try:
-        read_files = parser.read(path, encoding="utf-8")
+        parser.read_file(f)
     except configparser.Error as e:
         raise ConfigError(f"Ошибка чтения INI файла: {e}") from e
 
-    if not read_files:
-        raise ConfigError(f"Не удалось прочитать файл конфигурации: {path}")
-
     if "app" not in parser:
         raise ConfigError("Секция [app] отсутствует в файле конфигурации.")
 
-    section = parser["app"]
+    return config_from_section(parser["app"])
+
+
+def parse_toml_config(f: BinaryIO) -> AppConfig:
+    try:
+        import tomllib
+    except ImportError:
+        raise ConfigError("Конфигурация в формате TOML требует Python 3.11 или новее.") from None
+
+    try:
+        data = tomllib.load(f)
+    except tomllib.TOMLDecodeError as e:
+        raise ConfigError(f"Ошибка чтения TOML файла: {e}") from e
+
+    app = data.get("app")
+    if not isinstance(app, dict):
+        raise ConfigError("Секция [app] отсутствует в файле конфигурации.")
 
+    # Значения приводятся к строкам INI, чтобы обе формы проходили одну проверку
+    section: dict[str, str] = {}
+    for key, value in app.items():
+        if isinstance(value, bool):
+            value = "true" if value else "false"
+        elif not isinstance(value, str):
+            raise ConfigError(f"Параметр {key!r} должен быть строкой, получено: {value!r}")
+        section[key] = value
+    return config_from_section(section)
+
+
+def config_from_section(section: Mapping[str, str]) -> AppConfig:
     package_name = section.get("package_name", "").strip()
     if not package_name:
         raise ConfigError("Параметр 'package_name' обязателен и не может быть пустым.")
@@ -98,14 +169,14 @@ def load_config(path: str) -> AppConfig:
         test_repo_path = section.get("test_repo_path", "").strip()
         if not test_repo_path:
             raise ConfigError("Режим 'test': параметр 'test_repo_path' обязателен.")
-        if not os.path.exists(test_repo_path):
-            raise ConfigError(f"Режим 'test': файл тестового репозитория не найден: {test_repo_path}")
 
     ascii_tree_raw = section.get("ascii_tree", "false")
     ascii_tree = parse_bool(ascii_tree_raw)
 
+    repo_base = repo_url.rstrip("/") if repo_url else ""
+
     return AppConfig(package_name=package_name, version=version, mode=mode, repo_url=repo_url,
-        test_repo_path=test_repo_path, ascii_tree=ascii_tree, )
+        test_repo_path=test_repo_path, ascii_tree=ascii_tree, repo_base=repo_base, )
 
 
 def print_config(config: AppConfig) -> None:
@@ -119,35 +190,292 @@ def print_config(config: AppConfig) -> None:
 def build_metadata_url_for_root(config: AppConfig) -> str:
     if config.mode != "real":
         raise DependencyFetchError("Получение данных возможно только в режиме 'real'.")
-    base = (config.repo_url or "").rstrip("/")
-    return f"{base}/{config.package_name}/{config.version}/json"
+    return f"{config.repo_base}/{config.package_name}/{config.version}/json"
 
 
-def build_metadata_url_latest(config: AppConfig, package_name: str) -> str:
-    if config.mode != "real":
-        raise DependencyFetchError("Получение данных возможно только в режиме 'real'.")
-    base = (config.repo_url or "").rstrip("/")
-    return f"{base}/{package_name}/json"
+# ---------- HTTP ----------
+
+HTTP_TIMEOUT = 10
+FETCH_WORKERS = 16
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+
+@dataclass
+class HTTPResponse:
+    url: str
+    status: int
+    reason: str
+    headers: "http.client.HTTPMessage"
+    body: bytes
+
+
+def parse_proxy_url(proxy: str) -> Tuple[str, Optional[int], dict[str, str]]:
+    # Адрес прокси без схемы ("host:3128") допустим так же, как в urllib
+    from urllib import parse
+
+    parts = parse.urlsplit(proxy if "://" in proxy else "http://" + proxy)
+    headers: dict[str, str] = {}
+    if parts.username is not None:
+        import base64
+        credentials = f"{parse.unquote(parts.username)}:{parse.unquote(parts.password or '')}"
+        headers["Proxy-Authorization"] = "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+    return parts.hostname or "", parts.port, headers
+
+
+class HTTPSession:
+    """Пул keep-alive соединений: TCP/TLS-сокет к хосту переиспользуется между запросами."""
+
+    def __init__(self, pool_maxsize: int = 32, timeout: float = HTTP_TIMEOUT) -> None:
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        # Ключ пула — (схема, хост:порт, прокси): соединения через разные прокси не смешиваются
+        self._idle: dict[Tuple[str, str, Optional[str]], list[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+        self._ssl_context: Optional[ssl.SSLContext] = None
+        self._proxies: Optional[dict[str, str]] = None
+        self._bypass: dict[str, bool] = {}
+
+    def _proxy_for(self, scheme: str, host: str) -> Optional[str]:
+        # Как и urllib.request.urlopen, учитываем http_proxy/https_proxy/no_proxy.
+        # Окружение читается один раз, решение no_proxy запоминается для каждого хоста
+        import urllib.request
+
+        with self._lock:
+            if self._proxies is None:
+                self._proxies = urllib.request.getproxies()
+            proxy = self._proxies.get(scheme)
+        if not proxy:
+            return None
+        bypass = self._bypass.get(host)
+        if bypass is None:
+            bypass = self._bypass[host] = bool(urllib.request.proxy_bypass(host))
+        return None if bypass else proxy
+
+    def _acquire(self, key: Tuple[str, str, Optional[str]]) -> Tuple["http.client.HTTPConnection", bool]:
+        import http.client
+
+        scheme, netloc, proxy = key
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+            if scheme == "https" and self._ssl_context is None:
+                # Загрузка корневых сертификатов занимает десятки миллисекунд,
+                # поэтому один SSL-контекст создаётся лениво и используется всеми соединениями
+                import ssl
+                self._ssl_context = ssl.create_default_context()
+            context = self._ssl_context
+
+        if proxy is None:
+            if scheme != "https":
+                return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout, context=context), False
+
+        proxy_host, proxy_port, proxy_headers = parse_proxy_url(proxy)
+        if scheme != "https":
+            # Запрос к HTTP-хосту уходит прокси с абсолютным URI в строке запроса (см. _request)
+            return http.client.HTTPConnection(proxy_host, proxy_port, timeout=self.timeout), False
+        # HTTPS идёт через туннель CONNECT; TLS устанавливается с целевым хостом уже внутри него
+        conn = http.client.HTTPSConnection(proxy_host, proxy_port, timeout=self.timeout, context=context)
+        conn.set_tunnel(netloc, headers=proxy_headers)
+        return conn, False
+
+    def _release(self, key: Tuple[str, str, Optional[str]], conn: "http.client.HTTPConnection") -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.pool_maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    @staticmethod
+    def _send(conn: "http.client.HTTPConnection", url: str, path: str, headers: dict[str, str]) -> HTTPResponse:
+        import http.client
+        import zlib
+
+        conn.request("GET", path, headers=headers)
+        resp = conn.getresponse()
+        # Тело нужно дочитать целиком, иначе соединение нельзя вернуть в пул
+        body = resp.read()
+        if body and resp.headers.get("Content-Encoding", "").lower() == "gzip":
+            try:
+                # 16 + MAX_WBITS — формат gzip (заголовок и контрольная сумма), а не «голый» zlib
+                body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+            except zlib.error as e:
+                raise http.client.HTTPException(f"Не удалось распаковать gzip-ответ: {e}") from e
+        return HTTPResponse(url=url, status=resp.status, reason=resp.reason, headers=resp.headers, body=body)
+
+    def _request(self, url: str, headers: dict[str, str]) -> HTTPResponse:
+        import http.client
+        from urllib import parse
+
+        parts = parse.urlsplit(url)
+        proxy = self._proxy_for(parts.scheme, parts.hostname or "")
+        if proxy is not None and parts.scheme != "https":
+            path = parse.urlunsplit(parts._replace(fragment=""))
+            headers = {**headers, **parse_proxy_url(proxy)[2]}
+        else:
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+
+        key = (parts.scheme, parts.netloc, proxy)
+        conn, reused = self._acquire(key)
+        try:
+            try:
+                resp = self._send(conn, url, path, headers)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                if not reused:
+                    raise
+                # Сервер закрыл простаивавшее соединение — повторяем запрос на новом
+                conn.close()
+                resp = self._send(conn, url, path, headers)
+        except BaseException:
+            conn.close()
+            raise
+
+        self._release(key, conn)
+        return resp
+
+    def get(self, url: str, headers: Optional[dict[str, str]] = None) -> HTTPResponse:
+        from urllib import parse
+
+        # JSON метаданных хорошо сжимается: gzip уменьшает объём передаваемых данных в разы
+        request_headers = {"Accept": "application/json", "Accept-Encoding": "gzip", **(headers or {})}
+        resp = self._request(url, request_headers)
+        for _ in range(MAX_REDIRECTS):
+            location = resp.headers.get("Location")
+            if resp.status not in REDIRECT_STATUSES or not location:
+                break
+            resp = self._request(parse.urljoin(resp.url, location), request_headers)
+        return resp
+
+
+_SESSION = HTTPSession()
+
+
+# ---------- Кэш метаданных ----------
+
+# Каталог кэша можно переопределить переменной окружения PKGMGR_CACHE_DIR
+CACHE_DIR = os.environ.get("PKGMGR_CACHE_DIR") or os.path.expanduser("~/.cache/package-manager/pypi")
+# Метаданные закреплённой версии неизменны и хранятся бессрочно. Ответы для "последней версии"
+# свежи PKGMGR_CACHE_TTL секунд, после чего перепроверяются условным запросом (ETag/Last-Modified)
+try:
+    LATEST_CACHE_TTL = int(os.environ.get("PKGMGR_CACHE_TTL", "3600"))
+except ValueError:
+    LATEST_CACHE_TTL = 3600
+
+
+@dataclass
+class CacheEntry:
+    requires_dist: list[Any]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    age: float
+
+    def validators(self) -> dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+_json_lib: Any = None
+
+
+def get_json_lib() -> Any:
+    # orjson заметно быстрее стандартного json, но необязателен
+    global _json_lib
+    if _json_lib is None:
+        try:
+            import orjson
+            _json_lib = orjson
+        except ImportError:  # orjson не установлен — используем стандартный json
+            import json
+            _json_lib = json
+    return _json_lib
+
+
+def metadata_cache_path(cache_dir: str, url: str) -> str:
+    import hashlib
+
+    key = hashlib.blake2b(url.encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(cache_dir, f"{key}.json")
+
+
+def read_cache_entry(cache_dir: str, url: str) -> Optional[CacheEntry]:
+    path = metadata_cache_path(cache_dir, url)
+    try:
+        with open(path, "rb") as f:
+            age = time.time() - os.fstat(f.fileno()).st_mtime
+            data = get_json_lib().loads(f.read())
+    except (OSError, ValueError):
+        # Отсутствующий или повреждённый кэш — просто идём в сеть
+        return None
+
+    if not isinstance(data, dict) or not isinstance(data.get("requires_dist"), list):
+        return None
+    return CacheEntry(requires_dist=data["requires_dist"], etag=data.get("etag"),
+                      last_modified=data.get("last_modified"), age=age)
+
+
+def write_cache_entry(cache_dir: str, url: str, requires: list[Any], resp: HTTPResponse) -> None:
+    import tempfile
+
+    data = get_json_lib().dumps({"requires_dist": requires, "etag": resp.headers.get("ETag"),
+                                 "last_modified": resp.headers.get("Last-Modified")})
+    if isinstance(data, str):  # стандартный json возвращает str, orjson — bytes
+        data = data.encode("utf-8")
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, metadata_cache_path(cache_dir, url))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        # Ошибка записи кэша не должна мешать работе
+        pass
+
+
+def touch_cache_entry(cache_dir: str, url: str) -> None:
+    # Сервер подтвердил актуальность (304): продлеваем свежесть записи
+    try:
+        os.utime(metadata_cache_path(cache_dir, url))
+    except OSError:
+        pass
+
 
+def fetch_metadata_response(url: str, headers: Optional[dict[str, str]] = None) -> HTTPResponse:
+    import http.client
 
-def fetch_metadata_json(url: str) -> dict:
     try:
-        with request.urlopen(url) as resp:
-            if resp.status != 200:
-                raise DependencyFetchError(f"Сервер вернул статус {resp.status} при запросе {url!r}")
-            data = resp.read()
-    except error.HTTPError as e:
-        raise DependencyFetchError(f"HTTP ошибка при запросе {url!r}: {e.code} {e.reason}") from e
-    except error.URLError as e:
-        raise DependencyFetchError(f"Ошибка сети при запросе {url!r}: {e.reason}") from e
+        resp = _SESSION.get(url, headers)
+    except (OSError, http.client.HTTPException) as e:
+        raise DependencyFetchError(f"Ошибка сети при запросе {url!r}: {e}") from e
 
+    if resp.status >= 400:
+        raise DependencyFetchError(f"HTTP ошибка при запросе {url!r}: {resp.status} {resp.reason}")
+    # 304 допустим только в ответ на условный запрос
+    if resp.status != 200 and not (resp.status == 304 and headers):
+        raise DependencyFetchError(f"Сервер вернул статус {resp.status} при запросе {url!r}")
+    return resp
+
+
+def parse_metadata_body(url: str, body: bytes) -> dict[str, Any]:
     try:
-        return json.loads(data.decode("utf-8"))
-    except json.JSONDecodeError as e:
+        return get_json_lib().loads(body)
+    except ValueError as e:
         raise DependencyFetchError(f"Не удалось разобрать JSON-ответ от {url!r}: {e}") from e
 
 
-def parse_direct_dependencies_raw(metadata: dict) -> list[str]:
+def get_requires_dist(metadata: dict[str, Any]) -> list[Any]:
     info = metadata.get("info")
     if not isinstance(info, dict):
         raise DependencyFetchError("Неверный формат метаданных: нет 'info'.")
@@ -158,136 +486,239 @@ def parse_direct_dependencies_raw(metadata: dict) -> list[str]:
 
     if not isinstance(requires, list):
         raise DependencyFetchError("'requires_dist' должен быть списком.")
+    return requires
 
-    result = []
-    for item in requires:
-        if not isinstance(item, str):
-            continue
-        base = item.split(";", 1)[0].strip()
-        if base:
-            result.append(base)
-    return result
+
+def fetch_requires_dist(url: str, pinned: bool = False, cache_dir: Optional[str] = CACHE_DIR) -> list[Any]:
+    # В кэше хранится только info.requires_dist. cache_dir=None отключает дисковый кэш
+    cached = read_cache_entry(cache_dir, url) if cache_dir is not None else None
+    if cached is not None and (pinned or cached.age < LATEST_CACHE_TTL):
+        return cached.requires_dist
+
+    resp = fetch_metadata_response(url, cached.validators() if cached is not None else None)
+    if resp.status == 304 and cached is not None and cache_dir is not None:
+        touch_cache_entry(cache_dir, url)
+        return cached.requires_dist
+
+    requires = get_requires_dist(parse_metadata_body(url, resp.body))
+    if cache_dir is not None:
+        write_cache_entry(cache_dir, url, requires, resp)
+    return requires
+
+
+def parse_direct_dependencies_raw(requires: list[Any]) -> list[str]:
+    return [base for item in requires
+            if isinstance(item, str) and (base := item.partition(";")[0].strip())]
 
 
 def extract_package_name_from_requirement(req: str) -> Optional[str]:
-    s = req.split(";", 1)[0].strip()
-    if not s:
-        return None
-    m = re.match(r"([A-Za-z0-9_.\-]+)", s)
-    return m.group(1) if m else None
+    m = REQ_NAME_RE.match(req)
+    # Одно и то же имя встречается во многих списках зависимостей — храним его в единственном экземпляре
+    return sys.intern(m.group(1)) if m else None
 
 
-def parse_direct_dependency_names(metadata: dict) -> list[str]:
-    raw = parse_direct_dependencies_raw(metadata)
-    result = []
-    for r in raw:
-        name = extract_package_name_from_requirement(r)
-        if name:
-            result.append(name)
+# Ключ — текст маркера: одни и те же маркеры повторяются в метаданных многих пакетов
+MARKER_CACHE: dict[str, bool] = {}
+
+
+# Модуль packaging.markers; False — пакет packaging не установлен
+_packaging_markers: Any = None
+
+
+def evaluate_marker(marker: str) -> bool:
+    global _packaging_markers
+    if _packaging_markers is None:
+        try:
+            from packaging import markers as _packaging_markers
+        except ImportError:  # packaging не установлен — маркеры окружения проверяются упрощённо
+            _packaging_markers = False
+
+    # Extras не запрашиваются, поэтому "extra" считается пустым
+    if not _packaging_markers:
+        return not EXTRA_MARKER_RE.fullmatch(marker)
+    try:
+        return _packaging_markers.Marker(marker).evaluate({"extra": ""})
+    except (_packaging_markers.InvalidMarker, _packaging_markers.UndefinedComparison,
+            _packaging_markers.UndefinedEnvironmentName):
+        # Нераспознанный или невычислимый маркер (например, "~=" с нечисловой версией) не повод терять зависимость
+        return True
+
+
+def marker_applies(marker: str) -> bool:
+    result = MARKER_CACHE.get(marker)
+    if result is None:
+        result = MARKER_CACHE[marker] = evaluate_marker(marker)
     return result
 
 
-def print_direct_dependencies(config: AppConfig) -> None:
+def iter_direct_dependency_names(requires: list[Any]) -> Iterator[str]:
+    # Зависимости, чей маркер окружения ложен (extras, другая платформа/версия Python),
+    # в граф не попадают — их метаданные даже не запрашиваются
+    for item in requires:
+        if not isinstance(item, str):
+            continue
+        if ";" in item and not marker_applies(item.partition(";")[2]):
+            continue
+        name = extract_package_name_from_requirement(item)
+        if name:
+            yield name
+
+
+def parse_direct_dependency_names(requires: list[Any]) -> list[str]:
+    return list(iter_direct_dependency_names(requires))
+
+
+def print_direct_dependencies(config: AppConfig, cache_dir: Optional[str] = CACHE_DIR) -> list[Any]:
     url = build_metadata_url_for_root(config)
-    metadata = fetch_metadata_json(url)
-    deps = parse_direct_dependencies_raw(metadata)
+    requires = fetch_requires_dist(url, pinned=True, cache_dir=cache_dir)
+    deps = parse_direct_dependencies_raw(requires)
 
-    print()
-    print(f"Прямые зависимости пакета {config.package_name}=={config.version}:")
+    out = ["\n", f"Прямые зависимости пакета {config.package_name}=={config.version}:\n"]
     if not deps:
-        print("  (нет прямых зависимостей)")
+        out.append("  (нет прямых зависимостей)\n")
     else:
-        for dep in deps:
-            print(f"  - {dep}")
+        out.extend(f"  - {dep}\n" for dep in deps)
+    sys.stdout.write("".join(out))
 
+    # requires_dist корня возвращается, чтобы построение графа не запрашивало его повторно
+    return requires
 
-def bfs_recursive(start_nodes: Iterable[str], get_neighbors: Callable[[str], Iterable[str]]) -> Tuple[
-    dict[str, set[str]], set[Tuple[str, str]]]:
-    graph: dict[str, set[str]] = {}
-    visited: set[str] = set()
-    cycles: set[Tuple[str, str]] = set()
 
-    def bfs_level(frontier: list[str]) -> None:
-        if not frontier:
-            return
+def bfs_batched(start_nodes: Iterable[str],
+                get_neighbors_batch: Callable[[list[str]], Mapping[str, Iterable[str]]]) -> dict[str, tuple[str, ...]]:
+    graph: dict[str, tuple[str, ...]] = {}
+
+    # Вершина помечается при первом обнаружении, поэтому каждая попадает во фронт ровно один раз
+    frontier = list(dict.fromkeys(start_nodes))
+    seen = set(frontier)
+    seen_add = seen.add
+
+    while frontier:
+        # Соседи всех вершин уровня запрашиваются одним пакетом (реальный режим — параллельно),
+        # а граф собирается последовательно в порядке фронта
+        neighbors_by_node = get_neighbors_batch(frontier)
 
-        next_frontier = []
+        next_frontier: list[str] = []
+        next_append = next_frontier.append
 
         for node in frontier:
-            if node in visited:
-                continue
-            visited.add(node)
+            node_neighbors = set(neighbors_by_node[node])
+            for nb in node_neighbors:
+                if nb not in seen:
+                    seen_add(nb)
+                    next_append(nb)
+            graph[node] = tuple(sorted(node_neighbors))
 
-            neighbors = list(get_neighbors(node))
-            node_neighbors = graph.setdefault(node, set())
+        frontier = next_frontier
 
-            for nb in neighbors:
-                node_neighbors.add(nb)
-                if nb in visited:
-                    cycles.add((node, nb))
-                else:
-                    next_frontier.append(nb)
+    # Ключи и кортежи соседей отсортированы: функции вывода полагаются на этот порядок
+    return {node: graph[node] for node in sorted(graph)}
 
-        if next_frontier:
-            bfs_level(next_frontier)
 
-    bfs_level(list(start_nodes))
-    return graph, cycles
+def find_back_edges(graph: dict[str, tuple[str, ...]], start_nodes: Iterable[str]) -> set[Tuple[str, str]]:
+    # Итеративный DFS: цикл — только ребро в вершину, которая сейчас на стеке.
+    # Ребро в уже завершённую вершину (общая зависимость в DAG) циклом не считается
+    back_edges: set[Tuple[str, str]] = set()
+    finished: set[str] = set()
+    on_stack: set[str] = set()
 
+    for start in start_nodes:
+        if start in finished:
+            continue
+        on_stack.add(start)
+        stack = [(start, iter(graph.get(start, ())))]
+        while stack:
+            node, neighbors = stack[-1]
+            nb = next(neighbors, None)
+            if nb is None:
+                stack.pop()
+                on_stack.discard(node)
+                finished.add(node)
+            elif nb in on_stack:
+                back_edges.add((node, nb))
+            elif nb not in finished:
+                on_stack.add(nb)
+                stack.append((nb, iter(graph.get(nb, ()))))
+
+    return back_edges
 
-def load_test_repo_graph(path: str) -> dict[str, list[str]]:
+
+def bfs_recursive(start_nodes: Iterable[str], get_neighbors: Callable[[str], Iterable[str]]) -> Tuple[
+    dict[str, tuple[str, ...]], set[Tuple[str, str]]]:
+    start_nodes = list(start_nodes)
+    graph = bfs_batched(start_nodes, lambda nodes: {n: get_neighbors(n) for n in nodes})
+    return graph, find_back_edges(graph, start_nodes)
+
+
+def parse_test_repo_lines(lines: Iterable[str]) -> dict[str, list[str]]:
     graph: dict[str, list[str]] = {}
 
+    for lineno, line in enumerate(lines, 1):
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            continue
+        name_part, sep, deps_part = stripped.partition(":")
+        if not sep:
+            raise DependencyFetchError(f"Ошибка в строке {lineno}: ожидалось 'A: B C'.")
+        name = name_part.strip()
+        if not name.isalpha() or not name.isupper():
+            raise DependencyFetchError(f"Некорректное имя пакета '{name}' в строке {lineno}.")
+        deps = deps_part.replace(",", " ").split()
+        # Склейка из одних заглавных ASCII-букв возможна, только если такова каждая зависимость;
+        # иначе (в том числе для не-ASCII имён) каждая проверяется отдельно
+        joined = "".join(deps)
+        if not (joined.isascii() and joined.isalpha() and joined.isupper()):
+            for d in deps:
+                if not d.isalpha() or not d.isupper():
+                    raise DependencyFetchError(f"Некорректная зависимость '{d}' в строке {lineno}.")
+        graph[name] = deps
+
+    for d in {d for deps in graph.values() for d in deps}:
+        graph.setdefault(d, [])
+    return graph
+
+
+def load_test_repo_graph(path: str) -> dict[str, list[str]]:
     try:
         with open(path, encoding="utf-8") as f:
-            for lineno, line in enumerate(f, 1):
-                stripped = line.strip()
-                if not stripped or stripped.startswith("#"):
-                    continue
-                if ":" not in stripped:
-                    raise DependencyFetchError(f"Ошибка в строке {lineno}: ожидалось 'A: B C'.")
-                name_part, deps_part = stripped.split(":", 1)
-                name = name_part.strip()
-                if not name.isalpha() or not name.isupper():
-                    raise DependencyFetchError(f"Некорректное имя пакета '{name}' в строке {lineno}.")
-                deps_raw = deps_part.replace(",", " ").split()
-                deps = []
-                for d in deps_raw:
-                    if not d.isalpha() or not d.isupper():
-                        raise DependencyFetchError(f"Некорректная зависимость '{d}' в строке {lineno}.")
-                    deps.append(d)
-                graph[name] = deps
-
-        all_deps = {d for lst in graph.values() for d in lst}
-        for d in all_deps:
-            graph.setdefault(d, [])
+            return parse_test_repo_lines(f)
+    except FileNotFoundError:
+        raise DependencyFetchError(f"Файл тестового репозитория не найден: {path}") from None
     except OSError as e:
         raise DependencyFetchError(f"Ошибка чтения {path!r}: {e}") from e
 
-    return graph
 
+def build_dependency_graph_real(config: AppConfig, preloaded: Optional[dict[str, list[str]]] = None,
+                                cache_dir: Optional[str] = CACHE_DIR) -> Tuple[
+    dict[str, tuple[str, ...]], set[Tuple[str, str]]]:
+    cache: dict[str, list[str]] = dict(preloaded or {})
 
-def build_dependency_graph_real(config: AppConfig) -> Tuple[dict[str, set[str]], set[Tuple[str, str]]]:
-    cache: dict[str, list[str]] = {}
+    root = config.package_name
+    root_url = build_metadata_url_for_root(config)
+    repo_base = config.repo_base
 
-    def get_neighbors(pkg: str) -> list[str]:
-        if pkg in cache:
-            return cache[pkg]
+    def fetch_neighbors(pkg: str) -> list[str]:
+        pinned = pkg == root
+        url = root_url if pinned else f"{repo_base}/{pkg}/json"
+        requires = fetch_requires_dist(url, pinned=pinned, cache_dir=cache_dir)
+        return parse_direct_dependency_names(requires)
 
-        if pkg == config.package_name:
-            url = build_metadata_url_for_root(config)
-        else:
-            url = build_metadata_url_latest(config, pkg)
+    from concurrent.futures import ThreadPoolExecutor
 
-        metadata = fetch_metadata_json(url)
-        neighbors = parse_direct_dependency_names(metadata)
-        cache[pkg] = neighbors
-        return neighbors
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        def get_neighbors_batch(pkgs: list[str]) -> dict[str, list[str]]:
+            # Сеть опрашивается параллельно, кэш заполняется только в основном потоке
+            missing = [pkg for pkg in pkgs if pkg not in cache]
+            for pkg, neighbors in zip(missing, executor.map(fetch_neighbors, missing)):
+                cache[pkg] = neighbors
+            return {pkg: cache[pkg] for pkg in pkgs}
 
-    return bfs_recursive([config.package_name], get_neighbors)
+        graph = bfs_batched([root], get_neighbors_batch)
 
+    return graph, find_back_edges(graph, [root])
 
-def build_dependency_graph_test(config: AppConfig) -> Tuple[dict[str, set[str]], set[Tuple[str, str]]]:
+
+def build_dependency_graph_test(config: AppConfig) -> Tuple[dict[str, tuple[str, ...]], set[Tuple[str, str]]]:
     if not config.test_repo_path:
         raise DependencyFetchError("Не указан test_repo_path.")
 
@@ -302,28 +733,27 @@ def build_dependency_graph_test(config: AppConfig) -> Tuple[dict[str, set[str]],
     return bfs_recursive([config.package_name], get_neighbors)
 
 
-def print_dependency_graph(graph: dict[str, set[str]], cycles: set[Tuple[str, str]], root: str) -> None:
-    print()
-    print("Граф зависимостей:")
-    print(f"Корневой пакет: {root}\n")
+def print_dependency_graph(graph: dict[str, tuple[str, ...]], cycles: set[Tuple[str, str]], root: str) -> None:
+    out = ["\n", "Граф зависимостей:\n", f"Корневой пакет: {root}\n\n"]
 
-    for node in sorted(graph.keys()):
-        deps = sorted(graph[node]) if graph[node] else []
+    for node, deps in graph.items():
         if deps:
-            print(f"  {node} -> {', '.join(deps)}")
+            out.append(f"  {node} -> {', '.join(deps)}\n")
         else:
-            print(f"  {node} -> (нет зависимостей)")
+            out.append(f"  {node} -> (нет зависимостей)\n")
 
-    print()
+    out.append("\n")
     if cycles:
-        print("Обнаружены циклы:")
+        out.append("Обнаружены циклы:\n")
         for u, v in sorted(cycles):
-            print(f"  {u} -> {v}")
+            out.append(f"  {u} -> {v}\n")
     else:
-        print("Циклические зависимости не обнаружены.")
+        out.append("Циклические зависимости не обнаружены.\n")
+
+    sys.stdout.write("".join(out))
 
 
-def build_reverse_graph(graph: dict[str, set[str]]) -> dict[str, set[str]]:
+def build_reverse_graph(graph: dict[str, tuple[str, ...]]) -> dict[str, set[str]]:
     reverse: dict[str, set[str]] = {}
 
     for u, neighbors in graph.items():
@@ -334,71 +764,86 @@ def build_reverse_graph(graph: dict[str, set[str]]) -> dict[str, set[str]]:
     return reverse
 
 
-def print_reverse_dependencies(graph: dict[str, set[str]], root: str) -> None:
+def find_dependents(graph: dict[str, tuple[str, ...]], root: str) -> set[str]:
     reverse_graph = build_reverse_graph(graph)
 
-    subgraph, _ = bfs_recursive([root], lambda node: reverse_graph.get(node, set()))
+    reached = {root}
+    stack = [root]
+    while stack:
+        for u in reverse_graph.get(stack.pop(), ()):
+            if u not in reached:
+                reached.add(u)
+                stack.append(u)
+
+    reached.discard(root)
+    return reached
+
 
-    dependents = sorted(n for n in subgraph.keys() if n != root)
+def print_reverse_dependencies(graph: dict[str, tuple[str, ...]], root: str) -> None:
+    dependents = sorted(find_dependents(graph, root))
 
-    print()
-    print(f"Обратные зависимости для пакета {root}:")
+    out = ["\n", f"Обратные зависимости для пакета {root}:\n"]
     if not dependents:
-        print("  (нет пакетов, которые зависят от этого пакета)")
+        out.append("  (нет пакетов, которые зависят от этого пакета)\n")
     else:
-        for pkg in dependents:
-            print(f"  - {pkg}")
+        out.extend(f"  - {pkg}\n" for pkg in dependents)
+    sys.stdout.write("".join(out))
 
 
 # ---------- Graphviz (DOT) ----------
 
-def build_graphviz_dot(graph: dict[str, set[str]], root: str) -> str:
-    lines: list[str] = ["digraph dependencies {", f'  label="Dependencies for {root}";', "  labelloc=top;",
-                        "  node [shape=ellipse];"]
+def build_graphviz_dot(graph: dict[str, tuple[str, ...]], root: str) -> str:
+    header = ("digraph dependencies {", f'  label="Dependencies for {root}";', "  labelloc=top;",
+              "  node [shape=ellipse];")
 
-    # Явно выводим узлы без рёбер, чтобы они появились на диаграмме
-    all_nodes = set(graph.keys()) | {n for deps in graph.values() for n in deps}
-    for node in sorted(all_nodes):
-        lines.append(f'  "{node}";')
+    # Явно выводим узлы без рёбер, чтобы они появились на диаграмме.
+    # Каждый сосед — тоже вершина графа, поэтому достаточно обойти ключи
+    node_lines = (f'  "{node}";' for node in graph)
+    edge_lines = (f'  "{u}" -> "{v}";' for u, neighbors in graph.items() for v in neighbors)
 
-    for u in sorted(graph.keys()):
-        for v in sorted(graph[u]):
-            lines.append(f'  "{u}" -> "{v}";')
+    return "\n".join(itertools.chain(header, node_lines, edge_lines, ("}",)))
 
-    lines.append("}")
-    return "\n".join(lines)
 
-
-def print_graphviz_dot(graph: dict[str, set[str]], root: str) -> None:
-    print()
-    print("Представление графа в формате Graphviz (DOT):")
+def print_graphviz_dot(graph: dict[str, tuple[str, ...]], root: str) -> None:
     dot = build_graphviz_dot(graph, root)
-    print(dot)
+    sys.stdout.write(f"\nПредставление графа в формате Graphviz (DOT):\n{dot}\n")
 
 
 # ---------- ASCII-дерево ----------
 
-def print_ascii_tree(graph: dict[str, set[str]], root: str) -> None:
-    print()
-    print("ASCII-дерево зависимостей:")
-    print(root)
+def print_ascii_tree(graph: dict[str, tuple[str, ...]], root: str) -> None:
+    out = ["\n", "ASCII-дерево зависимостей:\n", f"{root}\n"]
+
+    # path — вершины на пути от корня до текущей: пополняется при спуске и очищается при возврате
+    path = {root}
+    stack: list[Tuple[str, str, tuple[str, ...], Iterator[Tuple[int, str]]]] = []
 
-    def _print_children(node: str, prefix: str, path: set[str]) -> None:
-        children = sorted(graph.get(node, set()))
-        for idx, child in enumerate(children):
-            is_last = (idx == len(children) - 1)
-            connector = "└── " if is_last else "├── "
-            line_prefix = prefix + connector
+    def _push(node: str, prefix: str) -> None:
+        children = graph.get(node, ())
+        stack.append((node, prefix, children, enumerate(children)))
 
-            if child in path:
-                print(f"{line_prefix}{child} (cycle)")
-                continue
+    _push(root, "")
+    while stack:
+        node, prefix, children, it = stack[-1]
+        step = next(it, None)
+        if step is None:
+            stack.pop()
+            path.discard(node)
+            continue
 
-            print(f"{line_prefix}{child}")
-            new_prefix = prefix + ("    " if is_last else "│   ")
-            _print_children(child, new_prefix, path | {child})
+        idx, child = step
+        is_last = (idx == len(children) - 1)
+        connector = "└── " if is_last else "├── "
 
-    _print_children(root, "", {root})
+        if child in path:
+            out.append(f"{prefix}{connector}{child} (cycle)\n")
+            continue
+
+        out.append(f"{prefix}{connector}{child}\n")
+        path.add(child)
+        _push(child, prefix + ("    " if is_last else "│   "))
+
+    sys.stdout.write("".join(out))
 
 
 # ---------- main ----------
@@ -406,9 +851,10 @@ def print_ascii_tree(graph: dict[str, set[str]], root: str) -> None:
 def main() -> None:
     parser = argparse.ArgumentParser(description=("Инструмент визуализации графа зависимостей.\n"
                                                   "Поддерживает этапы 1–5."))
-    parser.add_argument("-c", "--config", default="config.ini", help="Путь к INI файлу конфигурации")
+    parser.add_argument("-c", "--config", default="config.ini", help="Путь к файлу конфигурации (INI или .toml)")
     parser.add_argument("--no-config-print", action="store_true", help="Не выводить параметры конфигурации")
     parser.add_argument("--reverse-deps", action="store_true", help="Вывести обратные зависимости для пакета")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать дисковый кэш метаданных")
 
     args = parser.parse_args()
 
@@ -421,15 +867,19 @@ def main() -> None:
     if not args.no_config_print:
         print_config(config)
 
+    cache_dir = None if args.no_cache else CACHE_DIR
+
+    preloaded: dict[str, list[str]] = {}
     if config.mode == "real":
         try:
-            print_direct_dependencies(config)
+            root_requires = print_direct_dependencies(config, cache_dir)
+            preloaded[config.package_name] = parse_direct_dependency_names(root_requires)
         except Exception as e:
             print(f"Ошибка получения прямых зависимостей: {e}", file=sys.stderr)
 
     try:
         if config.mode == "real":
-            graph, cycles = build_dependency_graph_real(config)
+            graph, cycles = build_dependency_graph_real(config, preloaded, cache_dir)
         else:
             graph, cycles = build_dependency_graph_test(config)
 